@@ -1,17 +1,24 @@
 from __future__ import annotations
 
 import datetime
+import functools
+import hashlib
 import os.path
 import math
-from typing import Optional, List, Dict, Any
+import re
+from typing import Optional, List, Dict, Any, Callable
 
 import logging
 import urllib3
 import sys
 import json
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 
+import requests
 import yaml
+from requests.adapters import HTTPAdapter
 from krkn_lib.elastic.krkn_elastic import KrknElastic
 from krkn_lib.models.elastic.models import ElasticAlert
 from krkn_lib.models.krkn import ChaosRunAlertSummary, ChaosRunAlert
@@ -20,6 +27,294 @@ from krkn_lib.prometheus.krkn_prometheus import KrknPrometheus
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# upper bound of the prometheus queries issued concurrently
+MAX_QUERY_WORKERS = 16
+
+# on-disk cache of the range queries results, see _cached_range_query
+PROM_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "krkn", "promql")
+
+# json copies of the parsed alert/metrics profiles, see _read_profile
+PROFILE_CACHE_DIR = os.path.join(
+    os.path.expanduser("~"), ".cache", "krkn", "profiles"
+)
+
+# placeholder replaced by the chaos run duration in the metrics queries
+_ELAPSED_RE = re.compile(r"\.elapsed\b")
+
+# use the libyaml C parser when PyYAML has been built against it
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+@dataclass(frozen=True)
+class MetricQuery:
+    """
+    A metrics profile entry resolved for a chaos run
+    """
+
+    metric_name: str
+    query: str
+    """
+    promQL query with the .elapsed placeholder already replaced
+    """
+    instant: bool
+    """
+    runs as an instant query instead of a range query
+    """
+
+
+def _load_profile(profile_path: str) -> Any:
+    """
+    Loads a yaml alert/metrics profile, reusing the previously parsed
+    content if the file has not changed since the last load.
+
+    :param profile_path: path of the yaml profile
+    :return: the parsed profile content, shared between callers
+        and therefore not meant to be modified
+    """
+    stat = os.stat(profile_path)
+    return _cached_profile(
+        os.path.abspath(profile_path), stat.st_mtime_ns, stat.st_size
+    )
+
+
+# parsed profiles keyed by (path, mtime_ns, size) so that repeated runs
+# in the same process skip reading and parsing unchanged files, bounded
+# so that edited profiles do not pile up in long running processes
+@functools.lru_cache(maxsize=8)
+def _cached_profile(profile_path: str, mtime_ns: int, size: int) -> Any:
+    return _read_profile(profile_path)
+
+
+def _profile_sidecar_path(profile_path: str) -> str:
+    """
+    Returns the path of the json copy of a parsed yaml profile. The copies
+    are kept in the per user cache directory to leave the profile folder
+    untouched and out of reach of other users.
+
+    :param profile_path: absolute path of the yaml profile
+    :return: the path of the json sidecar
+    """
+    digest = hashlib.sha256(profile_path.encode("utf-8")).hexdigest()
+    return os.path.join(PROFILE_CACHE_DIR, f"{digest}.json")
+
+
+def _write_json_atomic(path: str, content: Any):
+    """
+    Writes content as json through a uniquely named temporary file in the
+    destination directory, so that concurrent writers never interleave and
+    readers only ever see complete files.
+
+    :param path: destination file
+    :param content: json serializable content
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(content, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _read_profile(profile_path: str) -> Any:
+    """
+    Parses a yaml profile, preferring its json sidecar when it was made
+    from a profile with exactly the same content. After a yaml parse the
+    sidecar is refreshed so that the next process start can skip the yaml
+    parser.
+
+    :param profile_path: absolute path of the yaml profile
+    :return: the parsed profile content
+    """
+    with open(profile_path, "rb") as profile:
+        profile_bytes = profile.read()
+    digest = hashlib.sha256(profile_bytes).hexdigest()
+
+    sidecar = _profile_sidecar_path(profile_path)
+    try:
+        with open(sidecar) as f:
+            sidecar_content = json.load(f)
+        if sidecar_content["sha256"] == digest:
+            return sidecar_content["profile"]
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    profile_yaml = yaml.load(profile_bytes, Loader=_YAML_LOADER)
+
+    try:
+        # json turns non string keys (e.g. `1:` or `on:`) into strings,
+        # only keep a copy that reads back exactly as the yaml parse
+        if json.loads(json.dumps(profile_yaml)) == profile_yaml:
+            _write_json_atomic(
+                sidecar, {"sha256": digest, "profile": profile_yaml}
+            )
+    except (OSError, TypeError, ValueError) as e:
+        logging.debug(f"unable to write the json copy of {profile_path}: {e}")
+    return profile_yaml
+
+
+@functools.lru_cache(maxsize=512)
+def _elapsed_template(query: str) -> tuple[str, ...]:
+    """
+    Splits a metrics query around its .elapsed placeholders, the query
+    is then rendered joining the parts with the elapsed time.
+
+    :param query: promQL query of the metrics profile
+    :return: the query parts surrounding the placeholders
+    """
+    return tuple(_ELAPSED_RE.split(query))
+
+
+def _size_connection_pool(prom_cli: KrknPrometheus, size: int):
+    """
+    Grows the HTTP connection pool of the prometheus client so that
+    concurrent queries reuse the open connections instead of discarding
+    them once the default pool (10 connections) is full.
+
+    :param prom_cli: the prometheus client
+    :param size: number of queries that will run concurrently
+    """
+    connection = getattr(prom_cli, "prom_cli", None)
+    session = getattr(connection, "_session", None)
+    if not isinstance(session, requests.Session):
+        return
+    adapter = session.get_adapter(connection.url)
+    if getattr(adapter, "_pool_maxsize", 0) >= size:
+        return
+    session.mount(
+        connection.url,
+        HTTPAdapter(pool_maxsize=size, max_retries=adapter.max_retries),
+    )
+    adapter.close()
+
+
+def _instant_query_at(
+    prom_cli: KrknPrometheus, query: str, timestamp: float
+) -> list[dict[str, Any]]:
+    """
+    Runs an instant query evaluated at the given time instead of the
+    current server time.
+
+    :param prom_cli: the prometheus client
+    :param query: promQL query
+    :param timestamp: evaluation time as a unix timestamp
+    :return: the query result, empty if the client couldn't be initialized
+    """
+    if not prom_cli.prom_cli:
+        logging.info(
+            "Skipping the prometheus query as the prometheus client "
+            "couldn't be initialized"
+        )
+        return []
+    try:
+        return prom_cli.prom_cli.custom_query(
+            query=query, params={"time": timestamp}
+        )
+    except Exception as e:
+        logging.error("Failed to get the metrics: %s" % e)
+        raise e
+
+
+def _cached_query(
+    prom_cli: KrknPrometheus,
+    query: str,
+    cache_key: str,
+    run_query: Callable[[], Any],
+) -> Any:
+    """
+    Runs a query through the on-disk query cache. The cache is
+    controlled by the KRKN_PROM_CACHE environment variable:
+
+    - off (default): the cache is not used
+    - on: results are read from the cache and stored on a miss
+    - replay: results are only read from the cache, a miss is an error
+
+    :param prom_cli: the prometheus client
+    :param query: promQL query
+    :param cache_key: description of the query and of its evaluation
+        times, unique among the queries sent to a prometheus instance
+    :param run_query: callable sending the query to prometheus
+    :return: the query result
+    """
+    mode = os.environ.get("KRKN_PROM_CACHE", "off").lower()
+    if mode not in ("on", "replay"):
+        return run_query()
+
+    prometheus_url = getattr(getattr(prom_cli, "prom_cli", None), "url", "")
+    key = hashlib.sha256(
+        f"{cache_key}|{prometheus_url}".encode("utf-8")
+    ).hexdigest()
+    cache_file = os.path.join(PROM_CACHE_DIR, f"{key}.json")
+    try:
+        with open(cache_file) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        if mode == "replay":
+            raise RuntimeError(
+                f"query {query} not found in the prometheus cache {PROM_CACHE_DIR}"
+            )
+
+    result = run_query()
+    try:
+        _write_json_atomic(cache_file, result)
+    except (OSError, TypeError, ValueError) as e:
+        logging.debug(f"unable to cache the result of {query}: {e}")
+    return result
+
+
+def _cached_range_query(
+    prom_cli: KrknPrometheus,
+    query: str,
+    start_time: datetime.datetime,
+    end_time: datetime.datetime,
+    granularity: int,
+) -> list[dict[str, Any]]:
+    """
+    Runs a range query through the on-disk query cache.
+
+    :param prom_cli: the prometheus client
+    :param query: promQL query
+    :param start_time: start time of the result set
+    :param end_time: end time of the result set
+    :param granularity: query resolution step in seconds
+    :return: the query result
+    """
+    return _cached_query(
+        prom_cli,
+        query,
+        f"{query}|{start_time.timestamp()}|{end_time.timestamp()}|"
+        f"{granularity}",
+        lambda: prom_cli.process_prom_query_in_range(
+            query,
+            start_time=start_time,
+            end_time=end_time,
+            granularity=granularity,
+        ),
+    )
+
+
+def _cached_instant_query_at(
+    prom_cli: KrknPrometheus, query: str, timestamp: float
+) -> list[dict[str, Any]]:
+    """
+    Runs an instant query evaluated at the given time through the
+    on-disk query cache.
+
+    :param prom_cli: the prometheus client
+    :param query: promQL query
+    :param timestamp: evaluation time as a unix timestamp
+    :return: the query result
+    """
+    return _cached_query(
+        prom_cli,
+        query,
+        f"instant|{query}|{timestamp}",
+        lambda: _instant_query_at(prom_cli, query, timestamp),
+    )
+
 
 def alerts(
     prom_cli: KrknPrometheus,
@@ -35,41 +330,58 @@ def alerts(
         logging.error(f"{alert_profile} alert profile does not exist")
         sys.exit(1)
 
-    with open(alert_profile) as profile:
-        profile_yaml = yaml.safe_load(profile)
-        if not isinstance(profile_yaml, list):
-            logging.error(
-                f"{alert_profile} wrong file format, alert profile must be "
-                f"a valid yaml file containing a list of items with at least 3 properties: "
-                f"expr, description, severity"
-            )
-            sys.exit(1)
+    profile_yaml = _load_profile(alert_profile)
+    if not isinstance(profile_yaml, list):
+        logging.error(
+            f"{alert_profile} wrong file format, alert profile must be "
+            f"a valid yaml file containing a list of items with at least 3 properties: "
+            f"expr, description, severity"
+        )
+        sys.exit(1)
+    if not profile_yaml:
+        logging.info(f"no alerts defined in {alert_profile}, skipping")
+        return
 
-        for alert in profile_yaml:
-            if list(alert.keys()).sort() != ["expr", "description", "severity"].sort():
-                logging.error(f"wrong alert {alert}, skipping")
-                continue
+    for alert in profile_yaml:
+        if list(alert.keys()).sort() != ["expr", "description", "severity"].sort():
+            logging.error(f"wrong alert {alert}, skipping")
+            continue
 
-            processed_alert = prom_cli.process_alert(
-                alert,
-                datetime.datetime.fromtimestamp(start_time),
-                datetime.datetime.fromtimestamp(end_time),
+        processed_alert = prom_cli.process_alert(
+            alert,
+            datetime.datetime.fromtimestamp(start_time),
+            datetime.datetime.fromtimestamp(end_time),
+        )
+        if (
+            processed_alert[0]
+            and processed_alert[1]
+            and elastic
+        ):
+            elastic_alert = ElasticAlert(
+                run_uuid=run_uuid,
+                severity=alert["severity"],
+                alert=processed_alert[1],
+                created_at=datetime.datetime.fromtimestamp(processed_alert[0]),
             )
-            if (
-                processed_alert[0]
-                and processed_alert[1]
-                and elastic
-            ):
-                elastic_alert = ElasticAlert(
-                    run_uuid=run_uuid,
-                    severity=alert["severity"],
-                    alert=processed_alert[1],
-                    created_at=datetime.datetime.fromtimestamp(processed_alert[0]),
-                )
-                result = elastic.push_alert(elastic_alert, elastic_alerts_index)
-                if result == -1:
-                    logging.error("failed to save alert on ElasticSearch")
-                pass
+            result = elastic.push_alert(elastic_alert, elastic_alerts_index)
+            if result == -1:
+                logging.error("failed to save alert on ElasticSearch")
+            pass
+
+
+def _chaos_run_alert(labels: dict[str, str]) -> ChaosRunAlert:
+    """
+    Builds a ChaosRunAlert from the labels of an ALERTS series
+
+    :param labels: the metric labels returned by prometheus
+    :return: the alert, missing labels are set to "none"
+    """
+    return ChaosRunAlert(
+        labels.get("alertname", "none"),
+        labels.get("alertstate", "none"),
+        labels.get("namespace", "none"),
+        labels.get("severity", "none"),
+    )
 
 
 def critical_alerts(
@@ -87,64 +399,36 @@ def critical_alerts(
     query = r"""ALERTS{severity="critical"}"""
     logging.info("Checking for critical alerts firing post chaos")
 
-    during_critical_alerts = prom_cli.process_prom_query_in_range(
-        query, start_time=datetime.datetime.fromtimestamp(start_time), end_time=end_time
-    )
+    # the during and post chaos queries are independent, overlap them
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        during_future = executor.submit(
+            prom_cli.process_prom_query_in_range,
+            query,
+            start_time=datetime.datetime.fromtimestamp(start_time),
+            end_time=end_time,
+        )
+        post_future = executor.submit(prom_cli.process_query, query)
+        during_critical_alerts = during_future.result()
+        post_critical_alerts = post_future.result()
 
     for alert in during_critical_alerts:
-        if "metric" in alert:
-            alertname = (
-                alert["metric"]["alertname"]
-                if "alertname" in alert["metric"]
-                else "none"
-            )
-            alertstate = (
-                alert["metric"]["alertstate"]
-                if "alertstate" in alert["metric"]
-                else "none"
-            )
-            namespace = (
-                alert["metric"]["namespace"]
-                if "namespace" in alert["metric"]
-                else "none"
-            )
-            severity = (
-                alert["metric"]["severity"] if "severity" in alert["metric"] else "none"
-            )
-            alert = ChaosRunAlert(alertname, alertstate, namespace, severity)
-            summary.chaos_alerts.append(alert)
+        labels = alert.get("metric")
+        if labels is not None:
+            summary.chaos_alerts.append(_chaos_run_alert(labels))
 
-    post_critical_alerts = prom_cli.process_query(query)
     for alert in post_critical_alerts:
-        if "metric" in alert:
-            alertname = (
-                alert["metric"]["alertname"]
-                if "alertname" in alert["metric"]
-                else "none"
-            )
-            alertstate = (
-                alert["metric"]["alertstate"]
-                if "alertstate" in alert["metric"]
-                else "none"
-            )
-            namespace = (
-                alert["metric"]["namespace"]
-                if "namespace" in alert["metric"]
-                else "none"
-            )
-            severity = (
-                alert["metric"]["severity"] if "severity" in alert["metric"] else "none"
-            )
-            alert = ChaosRunAlert(alertname, alertstate, namespace, severity)
+        labels = alert.get("metric")
+        if labels is not None:
+            alert = _chaos_run_alert(labels)
             summary.post_chaos_alerts.append(alert)
             if elastic:
                 elastic_alert = ElasticAlert(
                     run_uuid=run_id,
-                    severity=severity,
-                    alert=alertname,
+                    severity=alert.severity,
+                    alert=alert.alertname,
                     created_at=end_time,
-                    namespace=namespace,
-                    alertstate=alertstate,
+                    namespace=alert.namespace,
+                    alertstate=alert.alertstate,
                     phase="post_chaos"
                 )
                 result = elastic.push_alert(elastic_alert, elastic_alerts_index)
@@ -181,124 +465,160 @@ def metrics(
     if metrics_profile is None or os.path.exists(metrics_profile) is False:
         logging.error(f"{metrics_profile} alert profile does not exist")
         sys.exit(1)
-    with open(metrics_profile) as profile:
-        profile_yaml = yaml.safe_load(profile)
-
-        if not profile_yaml["metrics"] or not isinstance(profile_yaml["metrics"], list):
-            logging.error(
-                f"{metrics_profile} wrong file format, alert profile must be "
-                f"a valid yaml file containing a list of items with 3 properties: "
-                f"expr, description, severity"
+    profile_yaml = _load_profile(metrics_profile)
+
+    if not profile_yaml["metrics"] or not isinstance(profile_yaml["metrics"], list):
+        logging.error(
+            f"{metrics_profile} wrong file format, alert profile must be "
+            f"a valid yaml file containing a list of items with 3 properties: "
+            f"expr, description, severity"
+        )
+        sys.exit(1)
+    elapsed_ceil = math.ceil((end_time - start_time)/ 60 )
+    elapsed_time = str(elapsed_ceil) + "m"
+    metrics_list: list[dict[str, int | float | str]] = []
+    metric_queries: list[MetricQuery] = []
+    for metric_query in profile_yaml["metrics"]:
+        query = metric_query['query']
+        
+        # calculate elapsed time
+        query = elapsed_time.join(_elapsed_template(query))
+        if "instant" in list(metric_query.keys()) and metric_query['instant']:
+            metric_queries.append(
+                MetricQuery(metric_query['metricName'], query, True)
             )
-            sys.exit(1)
-        elapsed_ceil = math.ceil((end_time - start_time)/ 60 )
-        elapsed_time = str(elapsed_ceil) + "m"
-        metrics_list: list[dict[str, int | float | str]] = []
-        for metric_query in profile_yaml["metrics"]:
-            query = metric_query['query']
-            
-            # calculate elapsed time
-            if ".elapsed" in metric_query["query"]:
-                query = metric_query['query'].replace(".elapsed", elapsed_time)
-            if "instant" in list(metric_query.keys()) and metric_query['instant']:
-                metrics_result = prom_cli.process_query(
-                   query
-                )
-            elif (
-                list(metric_query.keys()).sort()
-                == ["query", "metricName"].sort()
-            ):
-                metrics_result = prom_cli.process_prom_query_in_range(
-                    query,
-                    start_time=datetime.datetime.fromtimestamp(start_time),
-                    end_time=datetime.datetime.fromtimestamp(end_time), granularity=30
-                )
-            else: 
-                logging.info('didnt match keys')
-                continue
+        elif (
+            list(metric_query.keys()).sort()
+            == ["query", "metricName"].sort()
+        ):
+            metric_queries.append(
+                MetricQuery(metric_query['metricName'], query, False)
+            )
+        else: 
+            logging.info('didnt match keys')
+            continue
+
+    granularity = 30
+
+    def run_query(metric_query: MetricQuery):
+        if not metric_query.instant and end_time <= start_time:
+            return []
+        if metric_query.instant:
+            return prom_cli.process_query(metric_query.query)
+        # a window shorter than the step holds at most one sample
+        if end_time - start_time < granularity:
+            return _cached_instant_query_at(
+                prom_cli, metric_query.query, end_time
+            )
+        return _cached_range_query(
+            prom_cli,
+            metric_query.query,
+            datetime.datetime.fromtimestamp(start_time),
+            datetime.datetime.fromtimestamp(end_time),
+            granularity,
+        )
+
+    # the queries are network bound, run them concurrently and
+    # consume the results in the profile order
+    workers = max(1, min(MAX_QUERY_WORKERS, len(metric_queries)))
+    _size_connection_pool(prom_cli, workers)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        metrics_results = list(executor.map(run_query, metric_queries))
+
+    # local bindings for the per sample loop
+    fromtimestamp = datetime.datetime.fromtimestamp
+    add_metric = metrics_list.append
+    for metric_query, metrics_result in zip(metric_queries, metrics_results):
+        for returned_metric in metrics_result:
+            metric = {
+                "query": metric_query.query,
+                "metricName": metric_query.metric_name,
+            }
+            metric.update(returned_metric['metric'])
             
-            for returned_metric in metrics_result:
-                metric = {"query": query, "metricName": metric_query['metricName']}
-                for k,v in returned_metric['metric'].items():
-                    metric[k] = v
-                
-                if "values" in returned_metric: 
-                    for value in returned_metric["values"]:
-                        try:
-                            metric['timestamp'] = str(datetime.datetime.fromtimestamp(value[0]))
-                            metric["value"] = float(value[1])
-                            # want double array of the known details and the metrics specific to each call                    
-                            metrics_list.append(metric.copy())
-                        except ValueError:
-                            pass
-                elif "value" in returned_metric:
+            values = returned_metric.get("values")
+            if values is not None:
+                for timestamp, value in values:
                     try:
-                        value = returned_metric["value"]
-                        metric['timestamp'] = str(datetime.datetime.fromtimestamp(value[0]))
-                        metric["value"] = float(value[1])
-
                         # want double array of the known details and the metrics specific to each call
-                        metrics_list.append(metric.copy())
+                        add_metric(
+                            {
+                                **metric,
+                                "timestamp": str(fromtimestamp(timestamp)),
+                                "value": float(value),
+                            }
+                        )
                     except ValueError:
                         pass
+            elif "value" in returned_metric:
+                try:
+                    timestamp, value = returned_metric["value"]
+                    # want double array of the known details and the metrics specific to each call
+                    add_metric(
+                        {
+                            **metric,
+                            "timestamp": str(fromtimestamp(timestamp)),
+                            "value": float(value),
+                        }
+                    )
+                except ValueError:
+                    pass
+    # the telemetry may be passed already decoded to skip a json round-trip
+    if isinstance(telemetry_json, (str, bytes)):
         telemetry_json = json.loads(telemetry_json)
-        for scenario in telemetry_json['scenarios']:
-            for k,v in scenario["affected_pods"].items():
-                metric_name = "affected_pods_recovery"
-                metric = {"metricName": metric_name, "type": k}
-                if type(v) is list:
-                    for pod in v:
-                        for k,v in pod.items():
-                            metric[k] = v
-                            metric['timestamp'] = str(datetime.datetime.now())
-                        print('adding pod' + str(metric))
-                        metrics_list.append(metric.copy())
-            for affected_node in scenario["affected_nodes"]:
-                metric_name = "affected_nodes_recovery"
-                metric = {"metricName": metric_name}
-                for k,v in affected_node.items():
-                    metric[k] = v
+    for scenario in telemetry_json['scenarios']:
+        for k,v in scenario["affected_pods"].items():
+            metric_name = "affected_pods_recovery"
+            metric = {"metricName": metric_name, "type": k}
+            if type(v) is list:
+                for pod in v:
+                    metric.update(pod)
                     metric['timestamp'] = str(datetime.datetime.now())
-                metrics_list.append(metric.copy())
-        if telemetry_json['health_checks']:
-            for health_check in telemetry_json["health_checks"]:
-                    metric_name = "health_check_recovery"
-                    metric = {"metricName": metric_name}
-                    for k,v in health_check.items():
-                        metric[k] = v
-                        metric['timestamp'] = str(datetime.datetime.now())
-                    metrics_list.append(metric.copy())
-        if telemetry_json['virt_checks']:
-            for virt_check in telemetry_json["virt_checks"]:
-                    metric_name = "virt_check_recovery"
-                    metric = {"metricName": metric_name}
-                    for k,v in virt_check.items():
-                        metric[k] = v
-                        metric['timestamp'] = str(datetime.datetime.now())
+                    print('adding pod' + str(metric))
                     metrics_list.append(metric.copy())
+        for affected_node in scenario["affected_nodes"]:
+            metric_name = "affected_nodes_recovery"
+            metric = {"metricName": metric_name}
+            metric.update(affected_node)
+            metric['timestamp'] = str(datetime.datetime.now())
+            metrics_list.append(metric.copy())
+    if telemetry_json['health_checks']:
+        for health_check in telemetry_json["health_checks"]:
+                metric_name = "health_check_recovery"
+                metric = {"metricName": metric_name}
+                metric.update(health_check)
+                metric['timestamp'] = str(datetime.datetime.now())
+                metrics_list.append(metric.copy())
+    if telemetry_json['virt_checks']:
+        for virt_check in telemetry_json["virt_checks"]:
+                metric_name = "virt_check_recovery"
+                metric = {"metricName": metric_name}
+                metric.update(virt_check)
+                metric['timestamp'] = str(datetime.datetime.now())
+                metrics_list.append(metric.copy())
 
-        save_metrics = False
-        if elastic is not None and elastic_metrics_index is not None:
-            result = elastic.upload_metrics_to_elasticsearch(
-                run_uuid=run_uuid, index=elastic_metrics_index, raw_data=metrics_list
-            )
-            if result == -1:
-                logging.error("failed to save metrics on ElasticSearch")
-                save_metrics = True
-        else:
+    save_metrics = False
+    if elastic is not None and elastic_metrics_index is not None:
+        result = elastic.upload_metrics_to_elasticsearch(
+            run_uuid=run_uuid, index=elastic_metrics_index, raw_data=metrics_list
+        )
+        if result == -1:
+            logging.error("failed to save metrics on ElasticSearch")
             save_metrics = True
-        if save_metrics:
-            local_dir = os.path.join(tempfile.gettempdir(), "krkn_metrics")
-            os.makedirs(local_dir, exist_ok=True)
-            local_file = os.path.join(local_dir, f"{elastic_metrics_index}_{run_uuid}.json")
-
-            try:
-                with open(local_file, "w") as f:
-                    json.dump({
-                        "run_uuid": run_uuid,
-                        "metrics": metrics_list
-                }, f, indent=2)
-                logging.info(f"Metrics saved to {local_file}")
-            except Exception as e:
-                logging.error(f"Failed to save metrics to {local_file}: {e}")
+    else:
+        save_metrics = True
+    if save_metrics:
+        local_dir = os.path.join(tempfile.gettempdir(), "krkn_metrics")
+        os.makedirs(local_dir, exist_ok=True)
+        local_file = os.path.join(local_dir, f"{elastic_metrics_index}_{run_uuid}.json")
+
+        try:
+            with open(local_file, "w") as f:
+                json.dump({
+                    "run_uuid": run_uuid,
+                    "metrics": metrics_list
+            }, f, indent=2)
+            logging.info(f"Metrics saved to {local_file}")
+        except Exception as e:
+            logging.error(f"Failed to save metrics to {local_file}: {e}")
     return metrics_list
@@ -425,8 +425,8 @@ def main(options, command: Optional[str]) -> int:
             logging.info("collecting Kubernetes cluster metadata....")
             telemetry_k8s.collect_cluster_metadata(chaos_telemetry)
 
-        telemetry_json = chaos_telemetry.to_json()
-        decoded_chaos_run_telemetry = ChaosRunTelemetry(json.loads(telemetry_json))
+        telemetry_json = json.loads(chaos_telemetry.to_json())
+        decoded_chaos_run_telemetry = ChaosRunTelemetry(telemetry_json)
         chaos_output.telemetry = decoded_chaos_run_telemetry
         logging.info(f"Chaos data:\n{chaos_output.to_json()}")
         if enable_elastic:
@@ -0,0 +1,570 @@
+#!/usr/bin/env python3
+
+"""
+Test suite for the prometheus client helpers
+
+This test file covers the alert and metrics profile handling in
+krkn.prometheus.client:
+- Profile loading and caching
+- Json sidecar of parsed profiles
+- Metrics collection
+- Prometheus range queries cache
+- Critical alerts collection
+- Prometheus connection pool sizing
+
+Usage:
+    python -m coverage run -a -m unittest tests/test_prometheus_client.py -v
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from unittest.mock import MagicMock, patch
+
+from krkn_lib.models.krkn import ChaosRunAlertSummary
+from krkn_lib.prometheus.krkn_prometheus import KrknPrometheus
+
+from krkn.prometheus import client
+
+
+class TestPrometheusClient(unittest.TestCase):
+
+    def setUp(self):
+        """
+        Set up a temporary alert profile and reset the profile cache
+        """
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.profile_path = os.path.join(self.tmp_dir.name, "alerts.yaml")
+        self.write_profile(
+            "- expr: up == 0\n"
+            "  description: target down\n"
+            "  severity: warning\n"
+        )
+        client._cached_profile.cache_clear()
+        tempdir_patcher = patch(
+            "krkn.prometheus.client.tempfile.gettempdir",
+            return_value=self.tmp_dir.name,
+        )
+        tempdir_patcher.start()
+        self.addCleanup(tempdir_patcher.stop)
+        self.profile_cache_dir = os.path.join(self.tmp_dir.name, "profiles")
+        profile_cache_patcher = patch(
+            "krkn.prometheus.client.PROFILE_CACHE_DIR", self.profile_cache_dir
+        )
+        profile_cache_patcher.start()
+        self.addCleanup(profile_cache_patcher.stop)
+
+    def tearDown(self):
+        """
+        Clean up the temporary directory and the profile cache
+        """
+        client._cached_profile.cache_clear()
+        self.tmp_dir.cleanup()
+
+    def write_profile(self, content, mtime_ns=None):
+        """
+        Helper to (re)write the profile, optionally forcing its mtime
+        """
+        with open(self.profile_path, "w") as f:
+            f.write(content)
+        if mtime_ns is not None:
+            os.utime(self.profile_path, ns=(mtime_ns, mtime_ns))
+
+    def test_load_profile(self):
+        """
+        Test _load_profile parses the yaml profile
+        """
+        profile = client._load_profile(self.profile_path)
+
+        self.assertEqual(
+            profile,
+            [
+                {
+                    "expr": "up == 0",
+                    "description": "target down",
+                    "severity": "warning",
+                }
+            ],
+        )
+
+    def test_load_profile_cached(self):
+        """
+        Test _load_profile does not parse an unchanged profile twice
+        """
+        first = client._load_profile(self.profile_path)
+        with patch("krkn.prometheus.client.yaml.load") as mock_load:
+            second = client._load_profile(self.profile_path)
+
+        mock_load.assert_not_called()
+        self.assertIs(first, second)
+
+    def test_load_profile_reloads_modified_file(self):
+        """
+        Test _load_profile parses the profile again once it changes
+        """
+        stat = os.stat(self.profile_path)
+        client._load_profile(self.profile_path)
+        self.write_profile(
+            "- expr: up == 1\n"
+            "  description: target up\n"
+            "  severity: info\n",
+            mtime_ns=stat.st_mtime_ns + 1_000_000_000,
+        )
+
+        profile = client._load_profile(self.profile_path)
+
+        self.assertEqual(profile[0]["expr"], "up == 1")
+
+    def test_load_profile_writes_sidecar(self):
+        """
+        Test _load_profile stores a json copy of the parsed profile
+        """
+        profile = client._load_profile(self.profile_path)
+        sidecar = client._profile_sidecar_path(
+            os.path.abspath(self.profile_path)
+        )
+        with open(self.profile_path, "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+
+        self.assertEqual(os.path.dirname(sidecar), self.profile_cache_dir)
+        with open(sidecar) as f:
+            self.assertEqual(
+                json.load(f), {"sha256": digest, "profile": profile}
+            )
+        self.assertEqual(os.listdir(self.profile_cache_dir), [
+            os.path.basename(sidecar)
+        ])
+
+    def test_load_profile_uses_fresh_sidecar(self):
+        """
+        Test _load_profile skips the yaml parser when the sidecar is fresh
+        """
+        profile = client._load_profile(self.profile_path)
+        client._cached_profile.cache_clear()
+        with patch("krkn.prometheus.client.yaml.load") as mock_load:
+            reloaded = client._load_profile(self.profile_path)
+
+        mock_load.assert_not_called()
+        self.assertEqual(reloaded, profile)
+
+    def test_load_profile_ignores_stale_sidecar(self):
+        """
+        Test _load_profile parses the yaml again when the profile is
+        replaced by one with an older modification time
+        """
+        stat = os.stat(self.profile_path)
+        client._load_profile(self.profile_path)
+        self.write_profile(
+            "- expr: up == 1\n"
+            "  description: restored profile\n"
+            "  severity: info\n",
+            mtime_ns=stat.st_mtime_ns - 1_000_000_000,
+        )
+        client._cached_profile.cache_clear()
+
+        profile = client._load_profile(self.profile_path)
+
+        self.assertEqual(profile[0]["description"], "restored profile")
+
+    def test_load_profile_ignores_mismatched_sidecar(self):
+        """
+        Test _load_profile does not trust a sidecar made from another
+        version of the profile
+        """
+        sidecar = client._profile_sidecar_path(
+            os.path.abspath(self.profile_path)
+        )
+        os.makedirs(self.profile_cache_dir)
+        with open(sidecar, "w") as f:
+            json.dump({"sha256": "0" * 64, "profile": ["planted"]}, f)
+
+        profile = client._load_profile(self.profile_path)
+
+        self.assertEqual(profile[0]["expr"], "up == 0")
+
+    def test_load_profile_same_size_and_mtime_edit(self):
+        """
+        Test _load_profile does not reuse the sidecar when the profile is
+        edited in place without changing its size or modification time
+        """
+        stat = os.stat(self.profile_path)
+        client._load_profile(self.profile_path)
+        self.write_profile(
+            "- expr: up == 1\n"
+            "  description: target down\n"
+            "  severity: warning\n",
+            mtime_ns=stat.st_mtime_ns,
+        )
+        self.assertEqual(os.stat(self.profile_path).st_size, stat.st_size)
+        client._cached_profile.cache_clear()
+
+        profile = client._load_profile(self.profile_path)
+
+        self.assertEqual(profile[0]["expr"], "up == 1")
+
+    def test_load_profile_non_string_keys(self):
+        """
+        Test _load_profile keeps yaml keys that json would turn into
+        strings and does not store a json copy of such a profile
+        """
+        self.write_profile("- 1: one\n  on: yes\n")
+        sidecar = client._profile_sidecar_path(
+            os.path.abspath(self.profile_path)
+        )
+
+        profile = client._load_profile(self.profile_path)
+        client._cached_profile.cache_clear()
+        reloaded = client._load_profile(self.profile_path)
+
+        self.assertEqual(profile, [{1: "one", True: True}])
+        self.assertEqual(reloaded, profile)
+        self.assertFalse(os.path.exists(sidecar))
+
+    def test_load_profile_unserializable_sidecar(self):
+        """
+        Test _load_profile leaves no partial file when the profile can't
+        be stored as json
+        """
+        self.write_profile("- expr: up == 0\n  created: 2024-01-01\n")
+
+        profile = client._load_profile(self.profile_path)
+
+        self.assertEqual(profile[0]["expr"], "up == 0")
+        self.assertFalse(os.path.exists(self.profile_cache_dir))
+
+    def test_alerts_empty_profile(self):
+        """
+        Test alerts() returns without querying when no alert is defined
+        """
+        self.write_profile("[]\n")
+        prom_cli = MagicMock()
+
+        client.alerts(
+            prom_cli, None, "uuid", 0, 600, self.profile_path, "index"
+        )
+
+        prom_cli.process_alert.assert_not_called()
+
+    def run_metrics(
+        self, prom_cli, profile, start_time=0, end_time=600, telemetry_json=None
+    ):
+        """
+        Helper to run metrics() against the given metrics profile content
+        """
+        metrics_path = os.path.join(self.tmp_dir.name, "metrics.yaml")
+        with open(metrics_path, "w") as f:
+            f.write(profile)
+        if telemetry_json is None:
+            telemetry_json = json.dumps(
+                {"scenarios": [], "health_checks": None, "virt_checks": None}
+            )
+        return client.metrics(
+            prom_cli,
+            None,
+            "uuid",
+            start_time,
+            end_time,
+            metrics_path,
+            "index",
+            telemetry_json,
+        )
+
+    def test_metrics_keeps_profile_order(self):
+        """
+        Test metrics() returns the samples in the profile order and routes
+        instant queries to process_query
+        """
+        prom_cli = MagicMock()
+        prom_cli.process_prom_query_in_range.return_value = [
+            {"metric": {"pod": "a"}, "values": [[1, "1"], [2, "2"]]}
+        ]
+        prom_cli.process_query.return_value = [
+            {"metric": {"pod": "b"}, "value": [3, "3"]}
+        ]
+
+        result = self.run_metrics(
+            prom_cli,
+            "metrics:\n"
+            "- query: rate(a[.elapsed])\n"
+            "  metricName: range\n"
+            "- query: b\n"
+            "  metricName: instant\n"
+            "  instant: true\n",
+        )
+
+        prom_cli.process_query.assert_called_once_with("b")
+        self.assertEqual(
+            prom_cli.process_prom_query_in_range.call_args[0][0], "rate(a[10m])"
+        )
+        self.assertEqual(
+            [(m["metricName"], m["value"]) for m in result],
+            [("range", 1.0), ("range", 2.0), ("instant", 3.0)],
+        )
+
+    def test_metrics_short_window(self):
+        """
+        Test metrics() skips range queries for empty or sub-step windows
+        and evaluates sub-step windows at the end of the window
+        """
+        prom_cli = MagicMock()
+        prom_cli.prom_cli.custom_query.return_value = [
+            {"metric": {"pod": "a"}, "value": [20, "1"]}
+        ]
+        profile = "metrics:\n- query: up\n  metricName: up\n"
+
+        empty = self.run_metrics(prom_cli, profile, start_time=10, end_time=10)
+        short = self.run_metrics(prom_cli, profile, start_time=10, end_time=20)
+
+        prom_cli.process_prom_query_in_range.assert_not_called()
+        prom_cli.process_query.assert_not_called()
+        prom_cli.prom_cli.custom_query.assert_called_once_with(
+            query="up", params={"time": 20}
+        )
+        self.assertEqual(empty, [])
+        self.assertEqual(len(short), 1)
+        self.assertEqual(short[0]["timestamp"], str(datetime.fromtimestamp(20)))
+
+    def test_metrics_short_window_replay(self):
+        """
+        Test metrics() serves sub-step windows from the query cache in
+        replay mode, without querying prometheus
+        """
+        prom_cli = MagicMock()
+        prom_cli.prom_cli.url = "http://prometheus"
+        prom_cli.prom_cli.custom_query.return_value = [
+            {"metric": {"pod": "a"}, "value": [20, "1"]}
+        ]
+        profile = "metrics:\n- query: up\n  metricName: up\n"
+        cache_dir = os.path.join(self.tmp_dir.name, "promql")
+
+        with patch("krkn.prometheus.client.PROM_CACHE_DIR", cache_dir):
+            with patch.dict(os.environ, {"KRKN_PROM_CACHE": "replay"}):
+                with self.assertRaises(RuntimeError):
+                    self.run_metrics(
+                        prom_cli, profile, start_time=10, end_time=20
+                    )
+            prom_cli.prom_cli.custom_query.assert_not_called()
+
+            with patch.dict(os.environ, {"KRKN_PROM_CACHE": "on"}):
+                stored = self.run_metrics(
+                    prom_cli, profile, start_time=10, end_time=20
+                )
+            with patch.dict(os.environ, {"KRKN_PROM_CACHE": "replay"}):
+                replayed = self.run_metrics(
+                    prom_cli, profile, start_time=10, end_time=20
+                )
+
+        prom_cli.prom_cli.custom_query.assert_called_once_with(
+            query="up", params={"time": 20}
+        )
+        prom_cli.process_prom_query_in_range.assert_not_called()
+        self.assertEqual(replayed, stored)
+
+    def test_instant_query_at_without_client(self):
+        """
+        Test _instant_query_at skips the query when the prometheus client
+        couldn't be initialized
+        """
+        prom_cli = MagicMock()
+        prom_cli.prom_cli = None
+
+        self.assertEqual(client._instant_query_at(prom_cli, "up", 20), [])
+
+    def test_metrics_decoded_telemetry(self):
+        """
+        Test metrics() accepts the telemetry already decoded
+        """
+        prom_cli = MagicMock()
+        prom_cli.process_query.return_value = []
+        telemetry = {
+            "scenarios": [],
+            "health_checks": [{"url": "http://app", "status": True}],
+            "virt_checks": None,
+        }
+
+        result = self.run_metrics(
+            prom_cli,
+            "metrics:\n"
+            "- query: up\n"
+            "  metricName: up\n"
+            "  instant: true\n",
+            telemetry_json=telemetry,
+        )
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]["metricName"], "health_check_recovery")
+        self.assertEqual(result[0]["url"], "http://app")
+        self.assertTrue(result[0]["status"])
+
+    def run_cached_query(self, prom_cli, mode):
+        """
+        Helper to run a cached range query with the given cache mode
+        """
+        cache_dir = os.path.join(self.tmp_dir.name, "promql")
+        with patch.dict(os.environ, {"KRKN_PROM_CACHE": mode}), patch(
+            "krkn.prometheus.client.PROM_CACHE_DIR", cache_dir
+        ):
+            return client._cached_range_query(
+                prom_cli,
+                "up",
+                datetime.fromtimestamp(0),
+                datetime.fromtimestamp(600),
+                30,
+            )
+
+    def test_cached_range_query_disabled(self):
+        """
+        Test _cached_range_query always queries prometheus when disabled
+        """
+        prom_cli = MagicMock()
+        prom_cli.process_prom_query_in_range.return_value = []
+
+        self.run_cached_query(prom_cli, "off")
+        self.run_cached_query(prom_cli, "off")
+
+        self.assertEqual(prom_cli.process_prom_query_in_range.call_count, 2)
+        self.assertFalse(
+            os.path.exists(os.path.join(self.tmp_dir.name, "promql"))
+        )
+
+    def test_cached_range_query_on(self):
+        """
+        Test _cached_range_query stores the result and replays it
+        """
+        prom_cli = MagicMock()
+        prom_cli.prom_cli.url = "http://prometheus"
+        prom_cli.process_prom_query_in_range.return_value = [
+            {"metric": {"pod": "a"}, "values": [[1, "1"]]}
+        ]
+
+        first = self.run_cached_query(prom_cli, "on")
+        second = self.run_cached_query(prom_cli, "replay")
+
+        prom_cli.process_prom_query_in_range.assert_called_once()
+        self.assertEqual(first, second)
+
+    def test_cached_range_query_concurrent_writers(self):
+        """
+        Test concurrent stores of the same query leave one complete entry
+        """
+        prom_cli = MagicMock()
+        prom_cli.process_prom_query_in_range.return_value = [
+            {"metric": {"pod": str(i)}, "values": [[i, "1"]]}
+            for i in range(200)
+        ]
+
+        cache_dir = os.path.join(self.tmp_dir.name, "promql")
+        with patch.dict(os.environ, {"KRKN_PROM_CACHE": "on"}), patch(
+            "krkn.prometheus.client.PROM_CACHE_DIR", cache_dir
+        ), ThreadPoolExecutor(max_workers=8) as executor:
+            list(
+                executor.map(
+                    lambda _: client._cached_range_query(
+                        prom_cli,
+                        "up",
+                        datetime.fromtimestamp(0),
+                        datetime.fromtimestamp(600),
+                        30,
+                    ),
+                    range(16),
+                )
+            )
+
+        self.assertEqual(len(os.listdir(cache_dir)), 1)
+        self.assertEqual(
+            self.run_cached_query(prom_cli, "replay"),
+            prom_cli.process_prom_query_in_range.return_value,
+        )
+
+    def test_cached_range_query_replay_miss(self):
+        """
+        Test _cached_range_query raises on a miss in replay mode
+        """
+        prom_cli = MagicMock()
+
+        with self.assertRaises(RuntimeError):
+            self.run_cached_query(prom_cli, "replay")
+        prom_cli.process_prom_query_in_range.assert_not_called()
+
+    def test_critical_alerts(self):
+        """
+        Test critical_alerts fills the summary with the firing alerts
+        """
+        prom_cli = MagicMock()
+        prom_cli.process_prom_query_in_range.return_value = [
+            {
+                "metric": {
+                    "alertname": "KubeAPIDown",
+                    "alertstate": "firing",
+                    "namespace": "default",
+                    "severity": "critical",
+                }
+            }
+        ]
+        prom_cli.process_query.return_value = [
+            {"metric": {"alertname": "etcdNoLeader"}}
+        ]
+        elastic = MagicMock()
+        summary = ChaosRunAlertSummary()
+
+        client.critical_alerts(
+            prom_cli,
+            summary,
+            elastic,
+            "uuid",
+            "pod_disruption_scenarios",
+            0,
+            datetime.fromtimestamp(600),
+            "index",
+        )
+
+        self.assertEqual(summary.scenario, "pod_disruption_scenarios")
+        self.assertEqual(len(summary.chaos_alerts), 1)
+        self.assertEqual(summary.chaos_alerts[0].alertname, "KubeAPIDown")
+        self.assertEqual(summary.chaos_alerts[0].namespace, "default")
+        self.assertEqual(len(summary.post_chaos_alerts), 1)
+        post_alert = summary.post_chaos_alerts[0]
+        self.assertEqual(post_alert.alertname, "etcdNoLeader")
+        self.assertEqual(post_alert.alertstate, "none")
+        self.assertEqual(post_alert.severity, "none")
+        elastic.push_alert.assert_called_once()
+        self.assertEqual(
+            elastic.push_alert.call_args[0][0].alert, "etcdNoLeader"
+        )
+
+    def test_size_connection_pool(self):
+        """
+        Test _size_connection_pool grows the pool of the client session
+        """
+        prom_cli = KrknPrometheus("http://prometheus:9090")
+        session = prom_cli.prom_cli._session
+        old_adapter = session.get_adapter("http://prometheus:9090")
+        retries = old_adapter.max_retries
+
+        with patch.object(old_adapter, "close") as mock_close:
+            client._size_connection_pool(prom_cli, 16)
+
+        adapter = session.get_adapter("http://prometheus:9090/api/v1/query")
+        self.assertEqual(adapter._pool_maxsize, 16)
+        self.assertIs(adapter.max_retries, retries)
+        mock_close.assert_called_once()
+
+    def test_size_connection_pool_keeps_larger_pool(self):
+        """
+        Test _size_connection_pool leaves a large enough pool untouched
+        """
+        prom_cli = KrknPrometheus("http://prometheus:9090")
+        session = prom_cli.prom_cli._session
+        adapter = session.get_adapter("http://prometheus:9090")
+
+        client._size_connection_pool(prom_cli, 2)
+
+        self.assertIs(session.get_adapter("http://prometheus:9090"), adapter)
+
+
+if __name__ == "__main__":
+    unittest.main()